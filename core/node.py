@@ -1,14 +1,173 @@
 import os
-import json
+import random
+import logging
+import orjson
 import asyncio
+from bisect import bisect_left, bisect_right, insort
+from collections import deque
+from itertools import chain, islice
+from operator import itemgetter
 from dotenv import load_dotenv
 
 # We're gonna be using aiohttp for requests instead of web3.py so we can avoid conflicts. Web3.py is kinda ass
-from aiohttp import ClientSession
+from aiohttp import ClientSession, ClientError, ClientTimeout, TCPConnector, WSMsgType
 
-# Import node URL
+# Import node URL. The websocket URL is optional, and enables following new swap logs as they happen
 load_dotenv()
 NODE_URL = os.getenv("NODE_URL")
+NODE_WS_URL = os.getenv("NODE_WS_URL")
+
+logger = logging.getLogger(__name__)
+
+
+""" Sharing a session between requests
+
+Opening a new session for every conversion throws away its connection pool,
+paying for DNS and a TLS handshake with the node every time. Instead, a single
+session is created lazily and kept alive until the app shuts down.
+
+"""
+
+shared_session: ClientSession | None = None
+
+async def get_session() -> ClientSession:
+    """ #### Get the shared aiohttp ClientSession, creating it if needed
+    :return: The shared aiohttp ClientSession object
+    """
+
+    global shared_session
+
+    if shared_session is None or shared_session.closed:
+        shared_session = ClientSession(
+            connector=TCPConnector(limit=100, limit_per_host=50, ttl_dns_cache=600, keepalive_timeout=60),
+            timeout=ClientTimeout(total=30)
+        )
+
+    return shared_session
+
+async def close_session():
+    """ #### Close the shared aiohttp ClientSession if it was created """
+
+    global shared_session
+
+    if shared_session is not None: await shared_session.close()
+    shared_session = None
+
+
+""" Sending requests to the node
+
+Every RPC call goes through post_rpc so that the whole process shares one cap
+on in-flight requests. Without it, gathering over hundreds of pools floods the
+node and most of the calls come back rate limited.
+
+"""
+
+RPC_SEMAPHORE = asyncio.Semaphore(20)
+RPC_MAX_ATTEMPTS = 8
+RPC_BACKOFF_BASE = 0.5
+RPC_MAX_BACKOFF = 30
+
+def get_backoff_delay(attempt: int, retry_after: str | None = None) -> float:
+    """ #### Get how long to wait before retrying a node request
+    :param attempt: The number of the attempt that failed, starting at 0
+    :param retry_after: The Retry-After header of the failed response, if any
+    :return: The delay in seconds
+
+    The delay doubles with every attempt and gets random jitter on top, so that
+    tasks rate limited at the same time don't all retry at the same time.
+    """
+
+    delay = min(RPC_MAX_BACKOFF, RPC_BACKOFF_BASE * 2 ** attempt) + random.random() * RPC_BACKOFF_BASE
+
+    # Honour the node's own hint when it gives one in seconds
+    if retry_after is not None:
+        try: delay = max(delay, float(retry_after))
+        except ValueError: pass
+
+    return delay
+
+async def post_rpc(session: ClientSession, payload: bytes) -> dict | list:
+    """ #### Send a JSON-RPC payload to the node
+    :param session: The aiohttp ClientSession object
+    :param payload: The JSON encoded request body
+    :return: The decoded JSON response
+
+    Retries rate limited and failed requests with exponential backoff and jitter,
+    giving up and raising the last error after RPC_MAX_ATTEMPTS attempts.
+    """
+
+    for attempt in range(RPC_MAX_ATTEMPTS):
+        retry_after = None
+
+        try:
+            async with RPC_SEMAPHORE:
+                async with session.post(NODE_URL, headers={'Content-Type': 'application/json'}, data=payload) as response:
+                    if response.status == 200: return orjson.loads(await response.read())
+
+                    retry_after = response.headers.get('Retry-After')
+                    error = Exception(f"Node request failed: [{response.status}] {await response.text()}")
+
+        except (ClientError, asyncio.TimeoutError) as e:
+            error = e
+
+        if attempt + 1 < RPC_MAX_ATTEMPTS: await asyncio.sleep(get_backoff_delay(attempt, retry_after))
+
+    raise error
+
+
+""" Building eth_call payloads
+
+Only the contract address and the function selector change between eth_call
+requests, so the payload is filled into a pre-encoded template instead of
+serialising a new dictionary every time. Addresses are hex strings, so they
+never need escaping.
+
+"""
+
+ETH_CALL_TEMPLATE = b'{"method":"eth_call","params":[{"to":"%b","data":"%b"}],"id":%d,"jsonrpc":"2.0"}'
+
+TOKEN0_SELECTOR = b"0x0dfe1681"
+TOKEN1_SELECTOR = b"0xd21220a7"
+DECIMALS_SELECTOR = b"0x313ce567"
+SYMBOL_SELECTOR = b"0x95d89b41"
+
+def eth_call_payload(contract_address: str, selector: bytes, id: int = 1) -> bytes:
+    """ #### Build the JSON encoded payload of an eth_call
+    :param contract_address: The address of the contract to call
+    :param selector: The function selector to call
+    :param id: The JSON-RPC request id
+    :return: The JSON encoded payload
+    """
+
+    return ETH_CALL_TEMPLATE % (contract_address.encode(), selector, id)
+
+
+""" Reading eth_call results
+
+An eth_call to an address with no contract, or one without the called function,
+comes back empty or reverted rather than failing the request. Those are told
+apart from node failures, so that callers can report a missing contract.
+
+"""
+
+class ContractCallException(Exception):...
+
+def get_call_result(response: dict, contract_address: str) -> str:
+    """ #### Get the result of an eth_call response
+    :param response: The decoded JSON-RPC response
+    :param contract_address: The address of the contract that was called
+    :return: The hex encoded result
+
+    :raises ContractCallException: If the call returned nothing or reverted
+    """
+
+    result = response.get('result')
+    if result is not None and result != "0x": return result
+
+    error = response.get('error')
+    if result == "0x" or "revert" in str(error).lower(): raise ContractCallException(f"Call to {contract_address} returned no result")
+
+    raise Exception(f"Node request failed: {error}")
 
 
 """ Getting token reserves of a pair for a specific block """
@@ -27,101 +186,267 @@ async def get_single_pool_token_async(session: ClientSession, pool_address: str,
     """
 
     functionSignature = None
-    if token == 0: functionSignature = "0x0dfe1681"
-    elif token == 1: functionSignature = "0xd21220a7"
+    if token == 0: functionSignature = TOKEN0_SELECTOR
+    elif token == 1: functionSignature = TOKEN1_SELECTOR
     else: raise Exception(f"Invalid token index: {token} - must be 0 or 1")
 
-    payload = json.dumps({
-        "method": "eth_call",
-        "params": [
-            {
-                "to": pool_address,
-                "data": functionSignature
-            }
-        ],
-        "id": 1,
-        "jsonrpc": "2.0"
-    })
+    payload = eth_call_payload(pool_address, functionSignature)
     
-    while True:
-        try:
-            async with session.post(NODE_URL, headers={'Content-Type': 'application/json'}, data=payload) as response:
-                if response.status == 429: 
-                    # print("Rate limited, waiting 1 second")
-                    await asyncio.sleep(1) # Rate limited
-
-                if response.status == 200:
-                    tokenAddress = "0x" + (await response.json())['result'][26:66]
-                    return tokenAddress
-                
-                raise Exception(f"Failed to get pool token: [{response.status}] {response.text}")
-            
-        except Exception as e:
-            # print(f"Got a weird error, retrying anyways lol: {response.status} {response.text} - {e}")
-            await asyncio.sleep(1)
+    tokenAddress = "0x" + (await post_rpc(session, payload))['result'][26:66]
+    return tokenAddress
 
 async def get_pool_tokens_async(session: ClientSession, pool_address: str) -> tuple[str, str]:
     """ #### Get the token addresses of a pool
     :param pool_address: The address of the pool
     :param session: The aiohttp ClientSession object
     :return: A tuple of the token addresses of the pool
-    
-    Also caches the result in Redis to speed up future requests
-    """    
+    """
 
     # Fetch both tokens concurrently
-
     tasks = [get_single_pool_token_async(session, pool_address, 0), get_single_pool_token_async(session, pool_address, 1)]
     tokens: list[str] = await asyncio.gather(*tasks)
 
     return tuple(tokens)
 
 
+# Providers cap how many calls fit in one batch (e.g. Moralis allows 20), so this can be lowered through the environment.
+# Every pool takes two calls, token0() and token1(), so a batch holds half as many pools
+NODE_BATCH_SIZE = int(os.getenv("NODE_BATCH_SIZE", 100))
+POOL_BATCH_SIZE = max(1, NODE_BATCH_SIZE // 2)
+
+async def get_pool_tokens_batch(session: ClientSession, pool_addresses: list[str]) -> dict[str, tuple[str, str]]:
+    """ #### Get the token addresses of many pools using JSON-RPC batch requests
+    :param session: The aiohttp ClientSession object
+    :param pool_addresses: The addresses of the pools
+    :return: A dictionary mapping each pool address to its token addresses
+
+    Sends the token0() and token1() calls of up to POOL_BATCH_SIZE pools, that is
+    up to NODE_BATCH_SIZE calls, in a single request. Pools whose calls fail (e.g.
+    contracts that emit the Swap event but aren't pools) are left out of the result.
+    """
+
+    async def fetch_chunk(chunk: list[str]) -> dict[str, tuple[str, str]]:
+        payload = b"[" + b",".join(
+            eth_call_payload(pool_address, functionSignature, 2 * i + token)
+            for i, pool_address in enumerate(chunk)
+            for token, functionSignature in enumerate((TOKEN0_SELECTOR, TOKEN1_SELECTOR))
+        ) + b"]"
+
+        # A batch the node rejects as a whole (e.g. too many calls) gets a single error object back instead of a list
+        responses = await post_rpc(session, payload)
+        if not isinstance(responses, list): raise Exception(f"Node rejected batch request: {responses.get('error', responses)}")
+
+        # Responses in a batch can come back in any order, so match them by id
+        results: dict[int, str] = {}
+        for response in responses:
+            result = response.get('result')
+            if result is not None and len(result) >= 66: results[response['id']] = "0x" + result[26:66]
+
+        pool_tokens: dict[str, tuple[str, str]] = {}
+        for i, pool_address in enumerate(chunk):
+            token0, token1 = results.get(2 * i), results.get(2 * i + 1)
+            if token0 is not None and token1 is not None: pool_tokens[pool_address] = (token0, token1)
+
+        return pool_tokens
+
+    chunks = [pool_addresses[i:i + POOL_BATCH_SIZE] for i in range(0, len(pool_addresses), POOL_BATCH_SIZE)]
+
+    pool_tokens: dict[str, tuple[str, str]] = {}
+    for chunk_tokens in await asyncio.gather(*[fetch_chunk(chunk) for chunk in chunks]):
+        pool_tokens.update(chunk_tokens)
+
+    return pool_tokens
+
+
+""" Following new swap logs over a websocket
+
+Most requests are for recent blocks, which overlap heavily with each other. When
+NODE_WS_URL is set, a background task subscribes to the node's Swap logs and
+keeps the last SWAP_LOG_BUFFER_BLOCKS blocks of them in memory, so those blocks
+are served without an eth_getLogs call.
+
+The node pushes one message per log, so the latest block seen may still be
+missing some of its logs. It is always fetched from the node instead.
+
+"""
+
+# Signature of the Swap event for Uniswap contracts
+SWAP_EVENT_SIGNATURE = "0xc42079f94a6350d7e6235f29174924f928cc2ac818eb64fed8004e115fbcca67"
+
+SWAP_LOG_BUFFER_BLOCKS = 1000
+
+# Logs are kept sorted by block number, which is parsed once and kept next to them so ranges can be bisected
+swap_log_buffer: deque[tuple[int, dict]] = deque()
+block_number_key = itemgetter(0)
+
+# The first block whose logs are all in the buffer, and the latest block seen. None until a log arrives
+swap_log_buffer_start: int | None = None
+swap_log_buffer_head: int | None = None
+
+def reset_swap_log_buffer():
+    """ #### Empty the swap log buffer, as logs can't be trusted to be complete after a disconnect """
+
+    global swap_log_buffer_start, swap_log_buffer_head
+
+    swap_log_buffer.clear()
+    swap_log_buffer_start = None
+    swap_log_buffer_head = None
+
+def add_swap_log(log: dict):
+    """ #### Add a swap log pushed by the node to the buffer
+    :param log: The log as sent by the node
+
+    Logs flagged as removed were dropped by a chain reorganisation, so they are
+    taken out of the buffer instead. Blocks older than SWAP_LOG_BUFFER_BLOCKS
+    behind the latest block are evicted.
+    """
+
+    global swap_log_buffer_start, swap_log_buffer_head
+
+    block_number = int(log['blockNumber'], 16)
+
+    if log.get('removed'):
+        key = (log['transactionHash'], log['logIndex'])
+        start = bisect_left(swap_log_buffer, block_number, key=block_number_key)
+        end = bisect_right(swap_log_buffer, block_number, key=block_number_key)
+
+        for i in reversed(range(start, end)):
+            if (swap_log_buffer[i][1]['transactionHash'], swap_log_buffer[i][1]['logIndex']) == key: del swap_log_buffer[i]
+        return
+
+    # The subscription may have started halfway through this block, so only the ones after it are complete
+    if swap_log_buffer_start is None: swap_log_buffer_start = block_number + 1
+    swap_log_buffer_head = block_number if swap_log_buffer_head is None else max(swap_log_buffer_head, block_number)
+
+    # Logs nearly always arrive in block order, but replacements after a reorganisation can be older than the latest block
+    if not swap_log_buffer or swap_log_buffer[-1][0] <= block_number: swap_log_buffer.append((block_number, log))
+    else: insort(swap_log_buffer, (block_number, log), key=block_number_key)
+
+    oldest_block = swap_log_buffer_head - SWAP_LOG_BUFFER_BLOCKS + 1
+    while swap_log_buffer and swap_log_buffer[0][0] < oldest_block: swap_log_buffer.popleft()
+    swap_log_buffer_start = max(swap_log_buffer_start, oldest_block)
+
+async def follow_swap_logs(session: ClientSession):
+    """ #### Subscribe to the node's Swap logs and buffer them until cancelled
+    :param session: The aiohttp ClientSession object
+
+    Reconnects with exponential backoff whenever the websocket drops or a message
+    can't be handled, starting over with an empty buffer.
+    """
+
+    payload = orjson.dumps({
+        "method": "eth_subscribe",
+        "params": ["logs", {"topics": [SWAP_EVENT_SIGNATURE]}],
+        "id": 1,
+        "jsonrpc": "2.0"
+    })
+
+    attempt = 0
+    while True:
+        try:
+            async with session.ws_connect(NODE_WS_URL, heartbeat=30) as ws:
+                await ws.send_str(payload.decode())
+
+                async for message in ws:
+                    if message.type != WSMsgType.TEXT and message.type != WSMsgType.BINARY: break
+
+                    # The first message only confirms the subscription, every other one carries a log
+                    log = orjson.loads(message.data).get('params', {}).get('result')
+                    if isinstance(log, dict): add_swap_log(log)
+                    attempt = 0
+
+        except Exception:
+            # Anything else would end the task and leave a stale buffer being served, so it's logged and followed by a reconnect
+            logger.exception("Swap log subscription failed, reconnecting")
+
+        reset_swap_log_buffer()
+        await asyncio.sleep(get_backoff_delay(attempt))
+        attempt = min(attempt + 1, RPC_MAX_ATTEMPTS)
+
+def get_buffered_swap_logs(from_block: int, to_block: int) -> list[dict]:
+    """ #### Get the buffered swap logs between two blocks
+    :param from_block: The block number to start from
+    :param to_block: The block number to end at
+    :return: A list of swap log events
+    """
+
+    start = bisect_left(swap_log_buffer, from_block, key=block_number_key)
+    end = bisect_right(swap_log_buffer, to_block, key=block_number_key)
+
+    return [log for _, log in islice(swap_log_buffer, start, end)]
+
+
 """ Getting raw swap logs for a range of blocks """
 
+SWAP_LOGS_BLOCK_STEP = 25
+
 async def get_raw_swap_logs(session: ClientSession, from_block: int, to_block: int) -> list[dict]:
     """ #### Get all swap log events between two blocks 
     :param from_block: The block number to start from
     :param to_block: The block number to end at
     :return: A list of swap log events
+
+    Ranges within the websocket buffer are read from memory, with only the latest
+    block seen and the ones after it fetched from the node. Otherwise the range is split into
+    sub-ranges of SWAP_LOGS_BLOCK_STEP blocks that are fetched concurrently,
+    rather than having the node serve one large query.
     """
 
-    # Signature of the Swap event for Uniswap contracts
-    EVENT_SIGNATURE = "0xc42079f94a6350d7e6235f29174924f928cc2ac818eb64fed8004e115fbcca67"
-    
-    payload = json.dumps({
-        "method": "eth_getLogs",
-        "params": [
-            {
-                "fromBlock": hex(from_block),
-                "toBlock": hex(to_block),
-                "topics": [EVENT_SIGNATURE]
-            }
-        ],
-        "id": 1,
-        "jsonrpc": "2.0" 
-        })
+    if swap_log_buffer_start is not None and from_block >= swap_log_buffer_start:
+        head_block = swap_log_buffer_head
+
+        logs = get_buffered_swap_logs(from_block, min(to_block, head_block - 1))
+        if to_block >= head_block: logs += await get_raw_swap_logs_from_node(session, max(from_block, head_block), to_block)
+        return logs
+
+    return await get_raw_swap_logs_from_node(session, from_block, to_block)
+
+async def get_raw_swap_logs_from_node(session: ClientSession, from_block: int, to_block: int) -> list[dict]:
+    """ #### Get all swap log events between two blocks with eth_getLogs
+    :param from_block: The block number to start from
+    :param to_block: The block number to end at
+    :return: A list of swap log events
+    """
+
+    async def fetch_range(start_block: int, end_block: int) -> list[dict]:
+        payload = orjson.dumps({
+            "method": "eth_getLogs",
+            "params": [
+                {
+                    "fromBlock": hex(start_block),
+                    "toBlock": hex(end_block),
+                    "topics": [SWAP_EVENT_SIGNATURE]
+                }
+            ],
+            "id": 1,
+            "jsonrpc": "2.0" 
+            })
+
+        return (await post_rpc(session, payload))['result']
+
+    ranges = [(start_block, min(to_block, start_block + SWAP_LOGS_BLOCK_STEP - 1)) for start_block in range(from_block, to_block + 1, SWAP_LOGS_BLOCK_STEP)]
     
-    headers = { 'Content-Type': 'application/json' }
+    logs = list(chain.from_iterable(await asyncio.gather(*[fetch_range(start_block, end_block) for start_block, end_block in ranges])))
+    return logs
 
-    while True:
-        try:
-            response = await session.post(NODE_URL, headers=headers, data=payload)
-            
-            if response.status == 200:
-                data = await response.json()
-                logs = data['result']
 
-                return logs
-            
-            print(f"Failed to get swap logs: [{response.status}] {response.text}")
-            await asyncio.sleep(1)
+""" Getting the latest block number """
 
-        except Exception as e:
-            raise e
-            print(f"Got a weird error, retrying anyways lol: {e}")
-            await asyncio.sleep(1)
-            continue
+async def get_block_number(session: ClientSession) -> int:
+    """ #### Get the number of the latest block
+    :param session: The aiohttp ClientSession object
+    :return: The latest block number
+    """
+
+    payload = orjson.dumps({
+        "method": "eth_blockNumber",
+        "params": [],
+        "id": 1,
+        "jsonrpc": "2.0"
+    })
+
+    block_number = int((await post_rpc(session, payload))['result'], 16)
+    return block_number
 
 
 """ Getting the token decimals of a token contract """
@@ -130,68 +455,24 @@ async def get_token_decimals(session: ClientSession, token_address: str) -> int:
     """ #### Get the decimals of a token
     :param token_address: The address of the token
     :return: The decimals of the token
+
+    :raises ContractCallException: If the address isn't a token contract
     """
 
-    functionSignature = "0x313ce567"
-    payload = json.dumps({
-        "method": "eth_call",
-        "params": [
-            {
-                "to": token_address,
-                "data": functionSignature
-            }
-        ],
-        "id": 1,
-        "jsonrpc": "2.0"
-    })
+    payload = eth_call_payload(token_address, DECIMALS_SELECTOR)
 
-    while True:
-        try:
-            response = await session.post(NODE_URL, headers={'Content-Type': 'application/json'}, data=payload)
-            
-            if response.status == 200:
-                decimals = int((await response.json())['result'], 16)
-                return decimals
-            
-            print(f"Failed to get token decimals: [{response.status}] {response.text}")
-            await asyncio.sleep(1)
-
-        except Exception as e:
-            print(f"Got a weird error, retrying anyways lol: {e}")
-            await asyncio.sleep(1)
-            continue
+    decimals = int(get_call_result(await post_rpc(session, payload), token_address), 16)
+    return decimals
 
 async def get_token_symbol(session: ClientSession, token_address: str) -> str:
     """ #### Get the symbol of a token
     :param token_address: The address of the token
     :return: The symbol of the token
+
+    :raises ContractCallException: If the address isn't a token contract
     """
 
-    functionSignature = "0x95d89b41"
-    payload = json.dumps({
-        "method": "eth_call",
-        "params": [
-            {
-                "to": token_address,
-                "data": functionSignature
-            }
-        ],
-        "id": 1,
-        "jsonrpc": "2.0"
-    })
+    payload = eth_call_payload(token_address, SYMBOL_SELECTOR)
 
-    while True:
-        try:
-            response = await session.post(NODE_URL, headers={'Content-Type': 'application/json'}, data=payload)
-            
-            if response.status == 200:
-                symbol = (await response.json())['result']
-                return bytes.fromhex(symbol[2:]).decode()
-            
-            print(f"Failed to get token symbol: [{response.status}] {response.text}")
-            await asyncio.sleep(1)
-
-        except Exception as e:
-            print(f"Got a weird error, retrying anyways lol: {e}")
-            await asyncio.sleep(1)
-            continue
\ No newline at end of file
+    symbol = get_call_result(await post_rpc(session, payload), token_address)
+    return bytes.fromhex(symbol[2:]).decode()
@@ -1,3 +1,4 @@
+from core.node import get_session, close_session
 from service.calculation import get_token_conversion_rate
 
 from asyncio import run
@@ -9,6 +10,12 @@ if __name__ == "__main__":
     TOKEN1 = "0xc02aaa39b223fe8d0a0e5c4f27ead9083c756cc2"
     BLOCK_NUMBER = 19_577_771
 
-    res = run(get_token_conversion_rate(TOKEN0, TOKEN1, BLOCK_NUMBER))
+    async def main():
+        try:
+            return await get_token_conversion_rate(TOKEN0, TOKEN1, BLOCK_NUMBER, await get_session())
+        finally:
+            await close_session()
+
+    res = run(main())
 
     print(res)
\ No newline at end of file
@@ -1,3 +1,5 @@
+import asyncio
+from contextlib import suppress
 from logging import error
 from traceback import format_exc
 
@@ -6,6 +8,7 @@ from fastapi.middleware.cors import CORSMiddleware
 from fastapi.responses import JSONResponse
 from Secweb import SecWeb
 
+from core.node import NODE_WS_URL, get_session, close_session, follow_swap_logs
 from service.controller import router
 
 api: FastAPI = FastAPI(
@@ -42,15 +45,35 @@ SecWeb(
 
 origins = ["*"]
 
+# The API is public and takes no cookies or auth headers. Browsers reject credentials with a wildcard origin anyway,
+# and leaving them off lets the wildcard be sent as is rather than echoing back each request's Origin
 api.add_middleware(
     CORSMiddleware,
     allow_origins=origins,
-    allow_credentials=True,
+    allow_credentials=False,
     allow_methods=["*"],
     allow_headers=["*"],
 )
 
 
+# Open a single node session on startup and share it between requests, closing it on shutdown.
+# When the node has a websocket, recent swap logs are followed in the background over the same session
+@api.on_event("startup")
+async def open_node_session():
+    api.state.http_session = await get_session()
+    api.state.swap_log_task = asyncio.create_task(follow_swap_logs(api.state.http_session)) if NODE_WS_URL else None
+
+
+@api.on_event("shutdown")
+async def close_node_session():
+    # Let the websocket close before the session it runs on does
+    if api.state.swap_log_task is not None:
+        api.state.swap_log_task.cancel()
+        with suppress(asyncio.CancelledError): await api.state.swap_log_task
+
+    await close_session()
+
+
 # Attach custom error handler to the api so instance so that all errors have their stack traces logged
 @api.exception_handler(HTTPException)
 async def http_exception_handler(request: Request, exc: HTTPException):
@@ -60,9 +83,6 @@ async def http_exception_handler(request: Request, exc: HTTPException):
     return JSONResponse(content={"detail": exc.detail}, status_code=exc.status_code)
 
 
-api.include_router(router)
-
-
 # Configure logging and return app
 def get_app(*args, **kwargs):
     @api.get("/test", include_in_schema=False)
@@ -1,6 +1,8 @@
 import os
+import asyncio
+from typing import Any, Awaitable, Callable
 from dotenv import load_dotenv
-import redis
+from redis.asyncio import Redis
 
 # Load the Redis URL
 load_dotenv()
@@ -12,28 +14,54 @@ We cache the two addresses for each pool contract so that we can avoid spamming
 the node with token0() and token1() contract calls. Because most trades are done
 on extremely popular pools, we can just cache the addresses and avoid the calls.
 
+Addresses come back from the node in mixed case, so every key and value is
+stored lowercase to keep a single entry per contract.
+
 """
 
 POOL_ADDRESSES_DB = 0
-pool_address_redis = redis.Redis(host=REDIS_URL, port=6379, db=POOL_ADDRESSES_DB)
+pool_address_redis = Redis(host=REDIS_URL, port=6379, db=POOL_ADDRESSES_DB)
 
-def set_pool_pair(pool_address: str, tokens: tuple[str, str]):
+async def set_pool_pair(pool_address: str, tokens: tuple[str, str]):
     """ #### Set the token addresses of a pool
     :param pool_address: The address of the pool
     :param tokens: A tuple of the token addresses of the pool
     """
     
-    pool_address_redis.set(pool_address, f"{tokens[0]},{tokens[1]}")
+    await pool_address_redis.set(pool_address.lower(), f"{tokens[0].lower()},{tokens[1].lower()}")
 
-def get_pool_pair(pool_address: str) -> tuple[str, str] | None:
+async def get_pool_pair(pool_address: str) -> tuple[str, str] | None:
     """ #### Get the token addresses of a pool
     :param pool_address: The address of the pool
     :return: A tuple of the token addresses of the pool
     """
     
-    if pool_address_redis.exists(pool_address): return tuple(pool_address_redis.get(pool_address).decode().split(","))
-    
-    return None
+    tokens = await pool_address_redis.get(pool_address.lower())
+    if tokens is None: return None
+
+    return tuple(tokens.decode().split(","))
+
+async def set_pool_pairs(pool_tokens: dict[str, tuple[str, str]]):
+    """ #### Set the token addresses of many pools in a single round trip
+    :param pool_tokens: A dictionary mapping each pool address to its token addresses
+    """
+
+    if not pool_tokens: return
+
+    async with pool_address_redis.pipeline(transaction=False) as pipeline:
+        for pool_address, tokens in pool_tokens.items():
+            pipeline.set(pool_address.lower(), f"{tokens[0].lower()},{tokens[1].lower()}")
+        await pipeline.execute()
+
+async def get_pool_pairs(pool_addresses: list[str]) -> list[tuple[str, str] | None]:
+    """ #### Get the token addresses of many pools in a single round trip
+    :param pool_addresses: The addresses of the pools
+    :return: The token addresses of each pool, or None for pools that aren't cached
+    """
+
+    if not pool_addresses: return []
+
+    return [tuple(tokens.decode().split(",")) if tokens is not None else None for tokens in await pool_address_redis.mget([pool_address.lower() for pool_address in pool_addresses])]
 
 
 """ Token Decimals Caching 
@@ -45,71 +73,96 @@ each time.
 """
 
 TOKEN_DECIMALS_DB = 1
-token_decimals_db = redis.Redis(host=REDIS_URL, port=6379, db=TOKEN_DECIMALS_DB)
+token_decimals_db = Redis(host=REDIS_URL, port=6379, db=TOKEN_DECIMALS_DB)
 
-def set_token_decimals(token_address: str, decimals: int):
+async def set_token_decimals(token_address: str, decimals: int):
     """ #### Set the decimals of a token
     :param token_address: The address of the token
     :param decimals: The decimals of the token
     """
     
-    token_decimals_db.set(token_address, decimals)
+    await token_decimals_db.set(token_address.lower(), decimals)
 
-def get_token_decimals(token_address: str) -> int | None:
+async def get_token_decimals(token_address: str) -> int | None:
     """ #### Get the decimals of a token
     :param token_address: The address of the token
     :return: The decimals of the token
     """
     
-    if token_decimals_db.exists(token_address): return int(token_decimals_db.get(token_address).decode())
-    
-    return None
+    decimals = await token_decimals_db.get(token_address.lower())
+    if decimals is None: return None
+
+    return int(decimals.decode())
 
 
 """ Token Symbol Caching """
 
 TOKEN_SYMBOLS_DB = 2
-token_symbols_db = redis.Redis(host=REDIS_URL, port=6379, db=TOKEN_SYMBOLS_DB)
+token_symbols_db = Redis(host=REDIS_URL, port=6379, db=TOKEN_SYMBOLS_DB)
 
-def set_token_symbol(token_address: str, symbol: str):
+async def set_token_symbol(token_address: str, symbol: str):
     """ #### Set the symbol of a token
     :param token_address: The address of the token
     :param symbol: The symbol of the token
     """
     
-    token_symbols_db.set(token_address, symbol)
+    await token_symbols_db.set(token_address.lower(), symbol)
 
-def get_token_symbol(token_address: str) -> str | None:
+async def get_token_symbol(token_address: str) -> str | None:
     """ #### Get the symbol of a token
     :param token_address: The address of the token
     :return: The symbol of the token
     """
     
-    if token_symbols_db.exists(token_address): return token_symbols_db.get(token_address).decode()
-    
-    return None
+    symbol = await token_symbols_db.get(token_address.lower())
+    if symbol is None: return None
 
+    return symbol.decode()
 
-""" Token Decimals Caching """
 
-TOKEN_DECIMALS_DB = 3
-token_decimals_db = redis.Redis(host=REDIS_URL, port=6379, db=TOKEN_DECIMALS_DB)
+""" In-flight Fetch Deduplication
 
-def set_token_decimals(token_address: str, decimals: int):
-    """ #### Set the decimals of a token
-    :param token_address: The address of the token
-    :param decimals: The decimals of the token
-    """
-    
-    token_decimals_db.set(token_address, decimals)
+Between a cache miss and the answer being cached, every other request for the
+same key also misses and goes to the node. Under a burst of requests for
+popular tokens that means many identical calls at once, so concurrent misses
+for a key share a single fetch instead.
 
-def get_token_decimals(token_address: str) -> int | None:
-    """ #### Get the decimals of a token
-    :param token_address: The address of the token
-    :return: The decimals of the token
+"""
+
+class AsyncCachedFetcher:
+    """ #### Fetches values through the cache, sharing in-flight fetches between callers
+    :param get_cached: Coroutine function returning the cached value of a key, or None
+    :param set_cached: Coroutine function caching the value of a key
+    :param fetch_fn: Coroutine function fetching the value of a key from the node, given a session and the key
     """
-    
-    if token_decimals_db.exists(token_address): return int(token_decimals_db.get(token_address).decode())
-    
-    return None
 
+    def __init__(self, get_cached: Callable[[str], Awaitable[Any]], set_cached: Callable[[str, Any], Awaitable[None]], fetch_fn: Callable[[Any, str], Awaitable[Any]]):
+        self.get_cached = get_cached
+        self.set_cached = set_cached
+        self.fetch_fn = fetch_fn
+        self.inflight: dict[str, asyncio.Task] = {}
+
+    async def fetch_and_cache(self, session, key: str):
+        value = await self.fetch_fn(session, key)
+        await self.set_cached(key, value)
+
+        return value
+
+    async def __call__(self, session, key: str):
+        """ #### Get the value of a key from the cache, or fetch it if it isn't cached
+        :param session: The aiohttp ClientSession object
+        :param key: The key to get the value of
+        :return: The value of the key
+        """
+
+        value = await self.get_cached(key)
+        if value is not None: return value
+
+        task = self.inflight.get(key)
+        if task is None:
+            task = asyncio.ensure_future(self.fetch_and_cache(session, key))
+            self.inflight[key] = task
+            task.add_done_callback(lambda _: self.inflight.pop(key, None))
+
+        # Shielded so that one caller being cancelled doesn't cancel the fetch for everyone waiting on it
+        return await asyncio.shield(task)
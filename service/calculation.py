@@ -1,26 +1,41 @@
-from dataclasses import dataclass
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from functools import lru_cache
+from itertools import chain
+import re
+import math
 import asyncio
 import time
+import logging
 from aiohttp import ClientSession
-from core.node import get_raw_swap_logs, get_token_decimals as fetch_token_decimals, get_token_symbol as fetch_token_symbol, get_pool_tokens_async as fetch_pool_tokens
+from core.node import ContractCallException, get_raw_swap_logs, get_block_number, get_pool_tokens_batch as fetch_pool_tokens_batch, get_token_decimals as fetch_token_decimals, get_token_symbol as fetch_token_symbol
 from service.cache import (
     get_token_decimals as get_cached_token_decimals, 
     get_token_symbol as get_cached_token_symbol, 
     set_token_decimals as set_cached_token_decimals, 
     set_token_symbol as set_cached_token_symbol, 
-    get_pool_pair as get_cached_pool_pair, 
-    set_pool_pair as set_cached_pool_pair
+    get_pool_pairs as get_cached_pool_pairs,
+    set_pool_pairs as set_cached_pool_pairs,
+    AsyncCachedFetcher
 )
 
 import rustworkx as rx
 
+logger = logging.getLogger(__name__)
+
 # Cache fetchers
 
 class ContractNotFoundException(Exception):...
+class SwapPathNotFoundException(Exception):...
+class InvalidAddressException(Exception):...
+
+token_decimals_fetcher = AsyncCachedFetcher(get_cached_token_decimals, set_cached_token_decimals, fetch_token_decimals)
+token_symbol_fetcher = AsyncCachedFetcher(get_cached_token_symbol, set_cached_token_symbol, fetch_token_symbol)
     
 async def get_token_decimals(session: ClientSession, token_address: str) -> int:
     """ Gets the token decimals from cache. If they're not there, gets 
-    them from the node and then caches the answer for next time. 
+    them from the node and then caches the answer for next time. Concurrent
+    calls for the same token share a single node request.
     
     :token_address: The address of the token contract
     :returns: The token decimals
@@ -28,20 +43,15 @@ async def get_token_decimals(session: ClientSession, token_address: str) -> int:
     :raises ContractNotFoundException: If the token contract is not found
     """
 
-    decimals: int | None = get_cached_token_decimals(token_address)
-    
     try:
-        if decimals is None: decimals = await fetch_token_decimals(session, token_address)
-    except Exception as e:
+        return await token_decimals_fetcher(session, token_address)
+    except ContractCallException as e:
         raise ContractNotFoundException(f"Token contract not found: {token_address}") from e
     
-    set_cached_token_decimals(token_address, decimals)
-
-    return decimals
-    
 async def get_token_symbol(session: ClientSession, token_address: str) -> str:
     """ Gets the token symbol from cache. If it's not there, gets 
-    it from the node and then caches the answer for next time. 
+    it from the node and then caches the answer for next time. Concurrent
+    calls for the same token share a single node request.
     
     :token_address: The address of the token contract
     :returns: The token symbol
@@ -50,44 +60,15 @@ async def get_token_symbol(session: ClientSession, token_address: str) -> str:
 
     """
 
-    symbol: str | None = get_cached_token_symbol(token_address)
-    
     try:
-        if symbol is None: symbol = await fetch_token_symbol(session, token_address)
-    except Exception as e:
+        return await token_symbol_fetcher(session, token_address)
+    except ContractCallException as e:
         raise ContractNotFoundException(f"Token contract not found: {token_address}") from e
-    
-    set_cached_token_symbol(token_address, symbol)
-
-    return symbol
-
-async def get_pool_tokens(session: ClientSession, pool_address: str) -> tuple[str, str]:
-    """ Gets the pool tokens from cache. If they're not there, gets 
-    them from the node and then caches the answer for next time. 
-    
-    :pool_address: The address of the pool contract
-    :returns: A tuple of the token addresses
-
-    :raises ContractNotFoundException: If the pool contract is not found
-    
-    """
-
-    tokens: tuple[str, str] | None = get_cached_pool_pair(pool_address)
-    
-    try:
-        if tokens is None: tokens = await fetch_pool_tokens(session, pool_address)
-    except Exception as e:
-        raise e
-        raise ContractNotFoundException(f"Pool contract not found: {pool_address}") from e
-    
-    set_cached_pool_pair(pool_address, tokens)
-
-    return tokens
 
 
 # Get swaps within a block range
 
-@dataclass
+@dataclass(slots=True, frozen=True)
 class SwapEvent:
     """ #### Represents a swap event between two tokens in a pool """
 
@@ -101,12 +82,34 @@ class SwapEvent:
     
     from_amount: int
     to_amount: int
-    
-    @property
-    def ratio(self) -> float:
-        """ #### Get the ratio of the swap """
-        
-        return self.to_amount / self.from_amount
+
+    # The ratio of the swap and its log, worked out once on creation so pathfinding can just add them up
+    ratio: float = field(init=False)
+    log_ratio: float = field(init=False)
+
+    def __post_init__(self):
+        ratio = self.to_amount / self.from_amount
+
+        object.__setattr__(self, "ratio", ratio)
+        object.__setattr__(self, "log_ratio", math.log(ratio))
+
+def decode_swap_amounts(data: str) -> tuple[int, int]:
+    """ #### Decode the absolute amounts of both tokens from a Swap log's data
+    :param data: The hex encoded data of the log
+    :return: A tuple of the token0 and token1 amounts
+
+    The amounts are parsed straight from the hex string, without going through bytes.
+    """
+
+    from_amount = int(data[2:66], 16)
+    to_amount = int(data[66:130], 16)
+
+    # The amounts are signed 256-bit integers. When the top bit is set the value is a negative
+    # two's complement, and its absolute value is what's left to reach 2^256
+    if from_amount >> 255: from_amount = (1 << 256) - from_amount
+    if to_amount >> 255: to_amount = (1 << 256) - to_amount
+
+    return from_amount, to_amount
 
 async def get_swaps(session: ClientSession, from_block: int, to_block: int) -> list[SwapEvent]:
     """ Gets the swaps from the node between two blocks
@@ -119,151 +122,300 @@ async def get_swaps(session: ClientSession, from_block: int, to_block: int) -> l
 
     logs: list[dict] = await get_raw_swap_logs(session, from_block, to_block)
     
-    # Parse all the contract addresses from the logs
-    pool_addresses: list[str] = list(set([log["address"] for log in logs]))
+    # Parse all the unique contract addresses from the logs in a single pass, keeping the order they were first seen in
+    pool_addresses: list[str] = list(dict.fromkeys(log["address"] for log in logs))
 
-    # Get the token pool pairs for each contract
-    pool_tokens_lst: list[tuple[str, str]] = await asyncio.gather(*[get_pool_tokens(session, pool_address) for pool_address in pool_addresses])
-    pool_tokens: dict[str, tuple[str, str]] = dict(zip(pool_addresses, pool_tokens_lst))
-        
-    # Parse list of SwapEvent objects
-    swaps: list[SwapEvent] = []
+    # Get the token pool pairs for each contract. Only the pools missing from the cache hit the node, batched
+    cached_pool_tokens: list[tuple[str, str] | None] = await get_cached_pool_pairs(pool_addresses)
+    pool_tokens: dict[str, tuple[str, str]] = { pool_address: tokens for pool_address, tokens in zip(pool_addresses, cached_pool_tokens) if tokens is not None }
 
-    for log in logs:
-        pool_address: str = log["address"]
-        from_token, to_token = pool_tokens[pool_address]
-        
-        swap = SwapEvent(
-                block_number = int(log['blockNumber'], 16),
-                transaction_hash = log['transactionHash'],
-                log_index = int(log['logIndex'], 16),
-                address = pool_address.lower(),
-                from_token = from_token.lower(),
-                to_token = to_token.lower(),
-                from_amount = abs(int.from_bytes(bytes.fromhex(log['data'][2:66]), signed=True)),
-                to_amount = abs(int.from_bytes(bytes.fromhex(log['data'][66:130]), signed=True))
-            )     
+    missing_pool_addresses: list[str] = [pool_address for pool_address, tokens in zip(pool_addresses, cached_pool_tokens) if tokens is None]
+    fetched_pool_tokens: dict[str, tuple[str, str]] = await fetch_pool_tokens_batch(session, missing_pool_addresses)
+    await set_cached_pool_pairs(fetched_pool_tokens)
+
+    pool_tokens.update(fetched_pool_tokens)
         
-        swaps.append(swap)
+    # Normalise each pool's addresses once, rather than once for every log it emitted
+    pools: dict[str, tuple[str, str, str]] = {
+        pool_address: (pool_address.lower(), from_token.lower(), to_token.lower())
+        for pool_address, (from_token, to_token) in pool_tokens.items()
+    }
+
+    # Parse list of SwapEvent objects in a single pass, skipping logs from contracts whose tokens couldn't be fetched
+    # and swaps that moved nothing, as they have no ratio.
+    # Fields are passed positionally: block_number, transaction_hash, log_index, (address, from_token, to_token), (from_amount, to_amount)
+    swaps: list[SwapEvent] = [
+        SwapEvent(int(log['blockNumber'], 16), log['transactionHash'], int(log['logIndex'], 16), *pools[log["address"]], *amounts)
+        for log in logs if log["address"] in pools and all(amounts := decode_swap_amounts(log['data']))
+    ]
 
     return swaps
 
 
-# Get ratio between two tokens
+# Reuse swaps between calls for nearby blocks
 
-async def get_token_conversion_rate(token0: str, token1: str, block_number: int) -> dict:
-    """ #### Get the conversion rate between two tokens at a specific block number
+SWAP_WINDOW_BUCKET = 50
+SWAP_WINDOW_CACHE_SIZE = 64
+
+# The newest blocks can still be reorganised, so only windows this many blocks behind the chain head are kept
+SWAP_WINDOW_CONFIRMATIONS = 12
+swap_window_cache: OrderedDict[tuple[int, int], list[SwapEvent]] = OrderedDict()
+
+# Windows being fetched right now, so that concurrent calls for the same window share a single fetch
+swap_window_inflight: dict[tuple[int, int], asyncio.Task] = {}
+
+async def get_swap_window(session: ClientSession, first_bucket: int, last_bucket: int) -> list[SwapEvent]:
+    """ Gets the swaps in a window of whole SWAP_WINDOW_BUCKET block buckets, so that calls
+    for nearby blocks share the same window. The most recently used windows are kept in memory.
+
+    :first_bucket: The first bucket of the window, as its first block divided by SWAP_WINDOW_BUCKET
+    :last_bucket: The last bucket of the window
+    :returns: A list of SwapEvent objects
+
+    """
+
+    from_block = first_bucket * SWAP_WINDOW_BUCKET
+    to_block = (last_bucket + 1) * SWAP_WINDOW_BUCKET - 1
+    window = (from_block, to_block)
+
+    swaps: list[SwapEvent] | None = swap_window_cache.get(window)
+    if swaps is not None:
+        swap_window_cache.move_to_end(window)
+        return swaps
+
+    task = swap_window_inflight.get(window)
+    if task is None:
+        task = asyncio.ensure_future(fetch_swap_window(session, from_block, to_block))
+        swap_window_inflight[window] = task
+        task.add_done_callback(lambda _: swap_window_inflight.pop(window, None))
+
+    # Shielded so that one caller being cancelled doesn't cancel the fetch for everyone waiting on it
+    return await asyncio.shield(task)
+
+async def fetch_swap_window(session: ClientSession, from_block: int, to_block: int) -> list[SwapEvent]:
+    """ Gets the swaps of a window from the node, caching them once the window is far enough behind the chain head
+
+    :from_block: The first block of the window
+    :to_block: The last block of the window
+    :returns: A list of SwapEvent objects
+
+    """
+
+    swaps, latest_block = await asyncio.gather(get_swaps(session, from_block, to_block), get_block_number(session))
+
+    # Windows that reach the newest blocks can still change, so they can't be reused
+    if to_block <= latest_block - SWAP_WINDOW_CONFIRMATIONS:
+        swap_window_cache[(from_block, to_block)] = swaps
+        if len(swap_window_cache) > SWAP_WINDOW_CACHE_SIZE: swap_window_cache.popitem(last=False)
+
+    return swaps
+
+
+def get_direct_swap(swaps: list[SwapEvent], token0: str, token1: str, block_number: int) -> SwapEvent | None:
+    """ Finds the swap made directly between two tokens that is closest to a block
+
+    :swaps: The swaps to search
     :token0: The address of the first token
     :token1: The address of the second token
-    :block_number: The block number to get the conversion rate at
-
-    :returns: A dictionary with the conversion rate, token decimals and token symbols
+    :block_number: The block to look closest to
+    :returns: The closest direct swap, or None if the tokens weren't swapped directly
 
-    Example:
-    ```json
-    {
-        "conversion_rate": 0.45,
-        "token0_decimals": 18,
-        "token1_decimals": 18,
-        "token0_symbol": "DAI",
-        "token1_symbol": "USDC"
-    }
-    ```
     """
 
-    token0 = token0.lower()
-    token1 = token1.lower()
+    pair = {token0, token1}
+    direct_swaps = (swap for swap in swaps if swap.from_token != swap.to_token and swap.from_token in pair and swap.to_token in pair)
 
-    session = ClientSession()
+    return min(direct_swaps, key=lambda swap: abs(swap.block_number - block_number), default=None)
 
-    token0_decimals = get_token_decimals(session, token0)
-    token1_decimals = get_token_decimals(session, token1)
-    token0_symbol = get_token_symbol(session, token0)
-    token1_symbol = get_token_symbol(session, token1)
+def get_path_log_ratio(swaps: list[SwapEvent], token0: str, token1: str) -> tuple[float, list[str]]:
+    """ Finds a path of swaps between two tokens and the log of its total ratio
 
-    # Get the swap logs
-    BLOCK_RANGE = 200
-    start = time.time()
-    swaps = await get_swaps(session, int(block_number - BLOCK_RANGE/2), int(block_number + BLOCK_RANGE/2))
-    print(f"Took {round(time.time() - start, 2)}s to get {len(swaps)} swap events for {BLOCK_RANGE} blocks.")
+    :swaps: The swaps to build the path from
+    :token0: The address of the first token
+    :token1: The address of the second token
+    :returns: A tuple of the log of the ratio and the token addresses along the path
 
-    # Compile all tokens into a set. Map each token to an integer and back
-    token_addresses: set[str] = set()
-    for swap in swaps:
-        token_addresses.add(swap.from_token)
-        token_addresses.add(swap.to_token)
+    :raises SwapPathNotFoundException: If either token wasn't swapped or no path connects them
 
-    token_id_map = { token: i for i, token in enumerate(token_addresses) }
-    token_id_map_inv = { i: token for token, i in token_id_map.items() }
+    """
 
-    # Build swap graph
-    graph = rx.PyGraph()
+    # Compile all tokens into a list. Each token's address is its node's data, so only the address to node map is needed
+    token_addresses: list[str] = list({swap.from_token for swap in swaps} | {swap.to_token for swap in swaps})
 
-    for id in token_id_map:
-        graph.add_node(token_id_map[id])
+    # Build swap graph. Each swap becomes a pair of directed edges whose data is the log of the rate in that
+    # direction, so the log of a path's total rate is just the sum of its edges
+    # Nodes and edges are added in bulk so they cross into rustworkx once rather than once per swap
+    graph = rx.PyDiGraph()
+    token_id_map = dict(zip(token_addresses, graph.add_nodes_from(token_addresses)))
 
+    edges: list[tuple[int, int, float]] = []
     for swap in swaps:
         from_token_id = token_id_map[swap.from_token]
         to_token_id = token_id_map[swap.to_token]
 
-        graph.add_edge(from_token_id, to_token_id, swap)
+        edges.append((from_token_id, to_token_id, swap.log_ratio))
+        edges.append((to_token_id, from_token_id, -swap.log_ratio))
 
-    # Find all shortest paths between two tokens
+    graph.add_edges_from(edges)
+
+    # Find the shortest path between two tokens
     from_token_id = token_id_map.get(token0)
-    if from_token_id is None: raise Exception(f"Token0 {token0} not found in swap events")
+    if from_token_id is None: raise SwapPathNotFoundException(f"Token0 {token0} not found in swap events")
     
     to_token_id = token_id_map.get(token1)
-    if to_token_id is None: raise Exception(f"Token {token1} not found in swap events")
-
-    # Get all shortest paths of swaps between two tokens
-    paths = rx.graph_all_shortest_paths(graph, from_token_id, to_token_id)
+    if to_token_id is None: raise SwapPathNotFoundException(f"Token {token1} not found in swap events")
 
-    # Make sure the paths are unique
-    paths = list(set([tuple(path) for path in paths]))
+    # Log rates can be negative, which Dijkstra doesn't allow, so the path is the one with the fewest swaps
+    paths = rx.dijkstra_shortest_paths(graph, from_token_id, target=to_token_id, default_weight=1.0)
 
-    # Get the path with the lowest conversion rate
     try:
-        path = paths[0]
+        path = paths[to_token_id]
     except IndexError:
-        raise Exception(f"No swap path found between token0 {token0} and token1 {token1}, unable to calculate conversion rate.")
+        raise SwapPathNotFoundException(f"No swap path found between token0 {token0} and token1 {token1}, unable to calculate conversion rate.")
 
-    total_ratio = 1
-    for i in range(len(path) - 1):
-        swap: SwapEvent = graph.get_edge_data(path[i], path[i + 1])
-        print(f"Swap from {swap.from_token} to {swap.to_token} with ratio {swap.ratio}: {swap}")
+    log_ratio = sum(graph.get_edge_data(path[i], path[i + 1]) for i in range(len(path) - 1))
 
-        # If the swap is from the first token to the second token, we need to divide the fromAmount by the toAmount to get the ratio
-        # If the swap is from the second token to the first token, we need to multiply the toAmount by the fromAmount to get the ratio
+    return log_ratio, [graph[token_id] for token_id in path]
 
-        if swap.from_token == token_id_map_inv[path[i]] and swap.to_token == token_id_map_inv[path[i + 1]]: total_ratio *= swap.ratio
-        elif swap.to_token == token_id_map_inv[path[i]] and swap.from_token == token_id_map_inv[path[i + 1]]: total_ratio /= swap.ratio
+# Probe the bucket of the block first, since popular pairs are swapped every few blocks, and only widen it when no path is found
+MAX_SWAP_WINDOW_BUCKETS = 10
 
-    # Multiple & Divide the ratio by the decimals
-    token0_decimals = await token0_decimals
-    token1_decimals = await token1_decimals
+async def find_swap_path(session: ClientSession, token0: str, token1: str, block_number: int) -> tuple[float, list[str]]:
+    """ Finds the ratio between two tokens around a block, starting with the single
+    SWAP_WINDOW_BUCKET block bucket the block is in and doubling the number of buckets
+    up to MAX_SWAP_WINDOW_BUCKETS until the tokens were swapped directly or a path of
+    swaps between them is found. Each widening only fetches the buckets it adds.
 
-    total_ratio = total_ratio * (10 ** token0_decimals)
-    total_ratio = total_ratio / (10 ** token1_decimals)
+    :token0: The address of the first token
+    :token1: The address of the second token
+    :block_number: The block the window is centered on
+    :returns: A tuple of the ratio and the token addresses along the path
 
-    def parse_symbol(symbol: str) -> str:
+    :raises SwapPathNotFoundException: If no path is found within MAX_SWAP_WINDOW_BUCKETS buckets
 
-        REPLACE_CHARS = ["\x00", "\x01", "\x02", "\x03", "\x04", "\x05", "\x06", "\x07", "\x08", "\x09", " "]
+    """
 
-        for char in REPLACE_CHARS:
-            symbol = symbol.replace(char, "")
+    # A token converts to itself one to one. No swap can ever connect it to itself, so there's nothing to search for
+    if token0 == token1: return 1.0, [token0]
 
-        return symbol
-        
+    first_bucket = last_bucket = block_number // SWAP_WINDOW_BUCKET
+
+    start = time.time()
+    swaps: list[SwapEvent] = await get_swap_window(session, first_bucket, last_bucket)
+
+    while True:
+        buckets = last_bucket - first_bucket + 1
+        if logger.isEnabledFor(logging.DEBUG): logger.debug(f"Took {round(time.time() - start, 2)}s to get {len(swaps)} swap events for {buckets * SWAP_WINDOW_BUCKET} blocks.")
+
+        # Most conversions are between tokens that were swapped directly with each other, which needs no graph at all.
+        # The ratio is taken straight from the amounts, as going through log space would lose precision
+        direct_swap: SwapEvent | None = get_direct_swap(swaps, token0, token1, block_number)
+        if direct_swap is not None:
+            return (direct_swap.ratio if direct_swap.from_token == token0 else direct_swap.from_amount / direct_swap.to_amount), [token0, token1]
+
+        try:
+            log_ratio, token_pair_path = get_path_log_ratio(swaps, token0, token1)
+            return math.exp(log_ratio), token_pair_path
+        except SwapPathNotFoundException:
+            if buckets >= MAX_SWAP_WINDOW_BUCKETS: raise
+
+        # Double the window without going past MAX_SWAP_WINDOW_BUCKETS, splitting the new buckets between both sides.
+        # An odd one out goes to the side the block is closest to
+        added_buckets = min(buckets, MAX_SWAP_WINDOW_BUCKETS - buckets)
+        closer_to_start = block_number - first_bucket * SWAP_WINDOW_BUCKET < (last_bucket + 1) * SWAP_WINDOW_BUCKET - 1 - block_number
+        added_before = (added_buckets + closer_to_start) // 2
+        added_after = added_buckets - added_before
+
+        new_windows = [(first_bucket - added_before, first_bucket - 1), (last_bucket + 1, last_bucket + added_after)]
+
+        start = time.time()
+        new_swaps = await asyncio.gather(*[get_swap_window(session, first, last) for first, last in new_windows if first <= last])
+
+        # Cached windows are shared, so the swaps are copied into a new list rather than extended in place
+        swaps = list(chain(swaps, *new_swaps))
+        first_bucket -= added_before
+        last_bucket += added_after
+
+
+# Get ratio between two tokens
+
+ADDRESS_PATTERN = re.compile(r"0x[0-9a-f]{40}")
+
+@lru_cache(maxsize=4096)
+def normalize_address(address: str) -> str:
+    """ Lowercases a token address and checks that it's plain hex, as it gets
+    filled straight into the node request payloads. Requests keep coming in for
+    the same few tokens, so the result is memoized.
+
+    :address: The address of the token
+    :returns: The lowercase address
+
+    :raises InvalidAddressException: If the address isn't a 0x prefixed 40 character hex string
+
+    """
+
+    address = address.lower()
+    if not ADDRESS_PATTERN.fullmatch(address): raise InvalidAddressException(f"Invalid token address: {address}")
+
+    return address
+
+# Symbols are returned ABI encoded, so they come padded with null bytes, length prefixes and spaces
+SYMBOL_STRIP_TABLE = str.maketrans("", "", "\x00\x01\x02\x03\x04\x05\x06\x07\x08\x09 ")
+
+@lru_cache(maxsize=4096)
+def parse_symbol(symbol: str) -> str:
+    """ Strips the padding characters from a token symbol in a single pass
+
+    :symbol: The symbol as decoded from the node
+    :returns: The symbol without padding
+
+    """
+
+    return symbol.translate(SYMBOL_STRIP_TABLE)
+
+async def get_token_conversion_rate(token0: str, token1: str, block_number: int, session: ClientSession) -> dict:
+    """ #### Get the conversion rate between two tokens at a specific block number
+    :token0: The address of the first token
+    :token1: The address of the second token
+    :block_number: The block number to get the conversion rate at
+    :session: The aiohttp ClientSession shared between requests
+
+    :returns: A dictionary with the conversion rate, token decimals and token symbols
+
+    Example:
+    ```json
+    {
+        "conversion_rate": 0.45,
+        "token0_decimals": 18,
+        "token1_decimals": 18,
+        "token0_symbol": "DAI",
+        "token1_symbol": "USDC"
+    }
+    ```
+    """
+
+    token0 = normalize_address(token0)
+    token1 = normalize_address(token1)
+
+    # Find the swap path, fetching the decimals and symbols of both tokens at the same time
+    (ratio, token_pair_path), token0_decimals, token1_decimals, token0_symbol, token1_symbol = await asyncio.gather(
+        find_swap_path(session, token0, token1, block_number),
+        get_token_decimals(session, token0),
+        get_token_decimals(session, token1),
+        get_token_symbol(session, token0),
+        get_token_symbol(session, token1)
+    )
+
+    # Scale the ratio by the difference in decimals, as a float power rather than two big integer ones
+    total_ratio = ratio * 10.0 ** (token0_decimals - token1_decimals)
 
     result = {
         "conversion_rate": total_ratio,
         "token0_decimals": token0_decimals,
         "token1_decimals": token1_decimals,
-        "token0_symbol": parse_symbol(await token0_symbol),
-        "token1_symbol": parse_symbol(await token1_symbol),
-        "token_pair_path": [token_id_map_inv[token_id] for token_id in path]
+        "token0_symbol": parse_symbol(token0_symbol),
+        "token1_symbol": parse_symbol(token1_symbol),
+        "token_pair_path": token_pair_path
     }
 
-    await session.close()
-
     return result
\ No newline at end of file
@@ -1,4 +1,6 @@
-from fastapi import APIRouter
+from fastapi import APIRouter, HTTPException, Request
+
+from service.calculation import ContractNotFoundException, SwapPathNotFoundException, InvalidAddressException, get_token_conversion_rate
 
 router = APIRouter(prefix="/tokens")
 
@@ -9,9 +11,17 @@ async def get_token_usd_price(token_address: str):
 
 
 @router.get("/{source_token_address}/to/{target_token_address}")
-async def get_token_exchange_rate(source_token_address: str, target_token_address: str):
+async def get_token_exchange_rate(request: Request, source_token_address: str, target_token_address: str, block_number: int):
+    try:
+        conversion = await get_token_conversion_rate(source_token_address, target_token_address, block_number, request.app.state.http_session)
+    except (ContractNotFoundException, SwapPathNotFoundException) as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    except InvalidAddressException as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
     return {
         "source_token_address": source_token_address,
         "target_token_address": target_token_address,
-        "exchange_rate": 1.0,
-    }
\ No newline at end of file
+        "block_number": block_number,
+        "exchange_rate": conversion["conversion_rate"],
+    }
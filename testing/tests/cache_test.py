@@ -0,0 +1,43 @@
+import asyncio
+
+from service.cache import AsyncCachedFetcher
+
+
+def make_fetcher() -> tuple[AsyncCachedFetcher, dict[str, str], list[str]]:
+    """ Builds a fetcher over an in-memory cache, with a node that records the keys it's asked for """
+
+    cache: dict[str, str] = {}
+    fetches: list[str] = []
+
+    async def get_cached(key):
+        return cache.get(key)
+
+    async def set_cached(key, value):
+        cache[key] = value
+
+    async def fetch(session, key):
+        fetches.append(key)
+        await asyncio.sleep(0.01)
+        return key.upper()
+
+    return AsyncCachedFetcher(get_cached, set_cached, fetch), cache, fetches
+
+
+def test_concurrent_misses_share_a_fetch():
+    fetcher, cache, fetches = make_fetcher()
+
+    async def fetch_concurrently():
+        return await asyncio.gather(*[fetcher(None, "weth") for _ in range(3)])
+
+    assert asyncio.run(fetch_concurrently()) == ["WETH"] * 3
+    assert fetches == ["weth"]
+    assert cache == {"weth": "WETH"}
+    assert fetcher.inflight == {}
+
+
+def test_cached_values_skip_the_node():
+    fetcher, cache, fetches = make_fetcher()
+    cache["usdc"] = "USDC"
+
+    assert asyncio.run(fetcher(None, "usdc")) == "USDC"
+    assert fetches == []
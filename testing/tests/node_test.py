@@ -0,0 +1,92 @@
+import asyncio
+
+import orjson
+import pytest
+
+import core.node as node
+
+
+def test_call_result_is_returned():
+    assert node.get_call_result({"jsonrpc": "2.0", "id": 1, "result": "0x12"}, "0x0") == "0x12"
+
+
+@pytest.mark.parametrize("response", [
+    {"jsonrpc": "2.0", "id": 1, "result": "0x"},
+    {"jsonrpc": "2.0", "id": 1, "error": {"code": 3, "message": "execution reverted"}},
+])
+def test_missing_contract_raises_contract_call_exception(response):
+    with pytest.raises(node.ContractCallException):
+        node.get_call_result(response, "0x0")
+
+
+def test_node_error_is_not_a_missing_contract():
+    with pytest.raises(Exception) as exc_info:
+        node.get_call_result({"jsonrpc": "2.0", "id": 1, "error": {"code": -32005, "message": "limit exceeded"}}, "0x0")
+
+    assert not isinstance(exc_info.value, node.ContractCallException)
+
+
+POOL_A = "0x" + "a" * 40
+POOL_B = "0x" + "b" * 40
+POOL_C = "0x" + "c" * 40
+
+
+def token_result(token: str) -> str:
+    """ The ABI encoded address returned by token0() and token1() """
+
+    return "0x" + "0" * 24 + token[2:]
+
+
+@pytest.fixture
+def batches(monkeypatch) -> list[list[dict]]:
+    """ Replaces post_rpc with a fake node that answers every call in reverse order, failing the calls to POOL_B """
+
+    sent: list[list[dict]] = []
+
+    async def post_rpc(session, payload):
+        batch = orjson.loads(payload)
+        sent.append(batch)
+
+        responses = []
+        for call in reversed(batch):
+            if call["params"][0]["to"] == POOL_B: responses.append({"jsonrpc": "2.0", "id": call["id"], "error": {"code": 3, "message": "execution reverted"}})
+            else: responses.append({"jsonrpc": "2.0", "id": call["id"], "result": token_result(call["params"][0]["to"][:-1] + str(call["id"] % 2))})
+
+        return responses
+
+    monkeypatch.setattr(node, "post_rpc", post_rpc)
+    return sent
+
+
+def test_pool_batch_matches_responses_by_id(batches):
+    pool_tokens = asyncio.run(node.get_pool_tokens_batch(None, [POOL_A, POOL_C]))
+
+    assert pool_tokens == {
+        POOL_A: (POOL_A[:-1] + "0", POOL_A[:-1] + "1"),
+        POOL_C: (POOL_C[:-1] + "0", POOL_C[:-1] + "1"),
+    }
+
+
+def test_pool_batch_drops_failed_pools(batches):
+    pool_tokens = asyncio.run(node.get_pool_tokens_batch(None, [POOL_A, POOL_B, POOL_C]))
+
+    assert set(pool_tokens) == {POOL_A, POOL_C}
+
+
+def test_pool_batch_is_split_by_call_count(batches, monkeypatch):
+    monkeypatch.setattr(node, "POOL_BATCH_SIZE", 2)
+
+    pool_tokens = asyncio.run(node.get_pool_tokens_batch(None, [POOL_A, POOL_B, POOL_C]))
+
+    assert [len(batch) for batch in batches] == [4, 2]
+    assert set(pool_tokens) == {POOL_A, POOL_C}
+
+
+def test_rejected_pool_batch_raises(monkeypatch):
+    async def post_rpc(session, payload):
+        return {"jsonrpc": "2.0", "id": None, "error": {"code": -32600, "message": "batch too large"}}
+
+    monkeypatch.setattr(node, "post_rpc", post_rpc)
+
+    with pytest.raises(Exception, match="batch too large"):
+        asyncio.run(node.get_pool_tokens_batch(None, [POOL_A]))
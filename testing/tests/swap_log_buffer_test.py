@@ -0,0 +1,140 @@
+import asyncio
+
+import pytest
+
+import core.node as node
+
+
+def make_log(block_number: int, log_index: int, removed: bool = False) -> dict:
+    return {
+        "address": "0x" + "1" * 40,
+        "blockNumber": hex(block_number),
+        "transactionHash": f"0x{block_number:064x}",
+        "logIndex": hex(log_index),
+        "data": "0x",
+        "removed": removed,
+    }
+
+
+def buffered_keys() -> list[tuple[int, int]]:
+    return [(block_number, int(log["logIndex"], 16)) for block_number, log in node.swap_log_buffer]
+
+
+@pytest.fixture(autouse=True)
+def empty_buffer():
+    node.reset_swap_log_buffer()
+    yield
+    node.reset_swap_log_buffer()
+
+
+@pytest.fixture
+def node_calls(monkeypatch) -> list[tuple[int, int]]:
+    """ Replaces eth_getLogs with a fake that records the ranges asked for """
+
+    calls = []
+
+    async def get_raw_swap_logs_from_node(session, from_block, to_block):
+        calls.append((from_block, to_block))
+        return [make_log(block_number, 0) for block_number in range(from_block, to_block + 1)]
+
+    monkeypatch.setattr(node, "get_raw_swap_logs_from_node", get_raw_swap_logs_from_node)
+    return calls
+
+
+def test_first_block_is_incomplete():
+    node.add_swap_log(make_log(100, 1))
+    node.add_swap_log(make_log(101, 0))
+
+    assert node.swap_log_buffer_start == 101
+    assert node.swap_log_buffer_head == 101
+    assert buffered_keys() == [(100, 1), (101, 0)]
+
+
+def test_old_blocks_are_evicted(monkeypatch):
+    monkeypatch.setattr(node, "SWAP_LOG_BUFFER_BLOCKS", 3)
+
+    for block_number in range(100, 106):
+        node.add_swap_log(make_log(block_number, 0))
+
+    assert node.swap_log_buffer_start == 103
+    assert buffered_keys() == [(103, 0), (104, 0), (105, 0)]
+
+
+def test_removed_logs_are_dropped():
+    for block_number in range(100, 103):
+        node.add_swap_log(make_log(block_number, 0))
+        node.add_swap_log(make_log(block_number, 1))
+
+    node.add_swap_log(make_log(101, 1, removed=True))
+
+    assert buffered_keys() == [(100, 0), (100, 1), (101, 0), (102, 0), (102, 1)]
+
+
+def test_late_logs_are_kept_in_block_order():
+    node.add_swap_log(make_log(100, 0))
+    node.add_swap_log(make_log(102, 0))
+    node.add_swap_log(make_log(101, 0))
+
+    assert buffered_keys() == [(100, 0), (101, 0), (102, 0)]
+    assert [int(log["blockNumber"], 16) for log in node.get_buffered_swap_logs(101, 101)] == [101]
+
+
+def test_head_block_is_fetched_from_node(node_calls):
+    for block_number in range(100, 110):
+        node.add_swap_log(make_log(block_number, 0))
+
+    # Only the first of the head block's two logs has arrived
+    node.add_swap_log(make_log(110, 0))
+
+    logs = asyncio.run(node.get_raw_swap_logs(None, 105, 112))
+
+    assert node_calls == [(110, 112)]
+    assert [int(log["blockNumber"], 16) for log in logs] == list(range(105, 113))
+
+
+def test_range_within_buffer_skips_node(node_calls):
+    for block_number in range(100, 110):
+        node.add_swap_log(make_log(block_number, 0))
+
+    logs = asyncio.run(node.get_raw_swap_logs(None, 102, 104))
+
+    assert node_calls == []
+    assert [int(log["blockNumber"], 16) for log in logs] == [102, 103, 104]
+
+
+def test_range_before_buffer_is_fetched_from_node(node_calls):
+    for block_number in range(100, 110):
+        node.add_swap_log(make_log(block_number, 0))
+
+    asyncio.run(node.get_raw_swap_logs(None, 100, 105))
+
+    assert node_calls == [(100, 105)]
+
+
+def test_subscription_survives_unexpected_errors(monkeypatch):
+    """ A failing connection must reset the buffer and reconnect, rather than end the task """
+
+    class FailingSession:
+        def __init__(self):
+            self.attempts = 0
+
+        def ws_connect(self, *args, **kwargs):
+            self.attempts += 1
+            raise TypeError("Unexpected payload")
+
+    async def follow_briefly(session):
+        task = asyncio.create_task(node.follow_swap_logs(session))
+        await asyncio.sleep(0.05)
+
+        assert not task.done()
+        task.cancel()
+
+    monkeypatch.setattr(node, "get_backoff_delay", lambda *args: 0)
+    node.add_swap_log(make_log(100, 0))
+
+    session = FailingSession()
+    asyncio.run(follow_briefly(session))
+
+    assert session.attempts > 1
+    assert node.swap_log_buffer_start is None
+    assert len(node.swap_log_buffer) == 0
@@ -0,0 +1,207 @@
+import asyncio
+
+import pytest
+
+import service.calculation as calculation
+
+
+def test_normalize_address_lowercases():
+    assert calculation.normalize_address("0x" + "AB" * 20) == "0x" + "ab" * 20
+
+
+@pytest.mark.parametrize("address", ["0xzz", "ab" * 20, "0x" + "a" * 39, "0x" + "a" * 41, "0x" + "a" * 39 + "\""])
+def test_normalize_address_rejects_malformed(address):
+    with pytest.raises(calculation.InvalidAddressException):
+        calculation.normalize_address(address)
+
+
+TOKEN_A = "0x" + "a" * 40
+TOKEN_B = "0x" + "b" * 40
+TOKEN_C = "0x" + "c" * 40
+
+
+def make_swap(block_number: int, from_token: str, to_token: str, from_amount: int = 1, to_amount: int = 1) -> calculation.SwapEvent:
+    return calculation.SwapEvent(block_number, f"0x{block_number:064x}", 0, "0x" + "1" * 40, from_token, to_token, from_amount, to_amount)
+
+
+@pytest.fixture
+def swap_windows(monkeypatch) -> tuple[dict[int, list[calculation.SwapEvent]], list[tuple[int, int]]]:
+    """ Replaces get_swap_window with one serving swaps by bucket, recording the bucket ranges asked for """
+
+    swaps_by_bucket: dict[int, list[calculation.SwapEvent]] = {}
+    calls: list[tuple[int, int]] = []
+
+    async def get_swap_window(session, first_bucket, last_bucket):
+        calls.append((first_bucket, last_bucket))
+        return [swap for bucket in range(first_bucket, last_bucket + 1) for swap in swaps_by_bucket.get(bucket, [])]
+
+    monkeypatch.setattr(calculation, "get_swap_window", get_swap_window)
+    return swaps_by_bucket, calls
+
+
+def test_find_swap_path_same_token_fetches_nothing(swap_windows):
+    _, calls = swap_windows
+
+    assert asyncio.run(calculation.find_swap_path(None, TOKEN_A, TOKEN_A, 1010)) == (1.0, [TOKEN_A])
+    assert calls == []
+
+
+def test_find_swap_path_probes_the_block_bucket_first(swap_windows):
+    swaps_by_bucket, calls = swap_windows
+    swaps_by_bucket[20] = [make_swap(1010, TOKEN_A, TOKEN_B, 1, 3000)]
+
+    assert asyncio.run(calculation.find_swap_path(None, TOKEN_A, TOKEN_B, 1010)) == (3000.0, [TOKEN_A, TOKEN_B])
+    assert calls == [(20, 20)]
+
+
+def test_find_swap_path_widens_in_buckets_up_to_the_cap(swap_windows):
+    _, calls = swap_windows
+
+    with pytest.raises(calculation.SwapPathNotFoundException):
+        asyncio.run(calculation.find_swap_path(None, TOKEN_A, TOKEN_B, 1010))
+
+    # Every bucket is fetched once. Block 1010 is near the start of bucket 20, so the odd bucket goes before it
+    assert calls == [(20, 20), (19, 19), (18, 18), (21, 21), (16, 17), (22, 23), (15, 15), (24, 24)]
+
+
+def test_find_swap_path_puts_the_odd_bucket_on_the_closer_side(swap_windows):
+    _, calls = swap_windows
+
+    with pytest.raises(calculation.SwapPathNotFoundException):
+        asyncio.run(calculation.find_swap_path(None, TOKEN_A, TOKEN_B, 1045))
+
+    assert calls[:2] == [(20, 20), (21, 21)]
+
+
+def test_find_swap_path_keeps_swaps_from_earlier_windows(swap_windows):
+    swaps_by_bucket, calls = swap_windows
+    swaps_by_bucket[20] = [make_swap(1010, TOKEN_A, TOKEN_C, 1, 2)]
+    swaps_by_bucket[19] = [make_swap(990, TOKEN_C, TOKEN_B, 1, 5)]
+
+    ratio, path = asyncio.run(calculation.find_swap_path(None, TOKEN_A, TOKEN_B, 1010))
+
+    assert ratio == pytest.approx(10)
+    assert path == [TOKEN_A, TOKEN_C, TOKEN_B]
+    assert calls == [(20, 20), (19, 19)]
+
+
+LATEST_BLOCK = 10_000
+
+
+@pytest.fixture
+def swap_fetches(monkeypatch) -> list[tuple[int, int]]:
+    """ Replaces the node behind get_swap_window, recording the block ranges fetched, with an empty window cache """
+
+    fetches: list[tuple[int, int]] = []
+
+    async def get_swaps(session, from_block, to_block):
+        fetches.append((from_block, to_block))
+        await asyncio.sleep(0.01)
+        return [make_swap(from_block, TOKEN_A, TOKEN_B)]
+
+    async def get_block_number(session):
+        return LATEST_BLOCK
+
+    monkeypatch.setattr(calculation, "get_swaps", get_swaps)
+    monkeypatch.setattr(calculation, "get_block_number", get_block_number)
+
+    calculation.swap_window_cache.clear()
+    yield fetches
+    calculation.swap_window_cache.clear()
+
+
+def test_swap_window_is_cached_behind_the_head(swap_fetches):
+    async def fetch_twice():
+        return await calculation.get_swap_window(None, 100, 100), await calculation.get_swap_window(None, 100, 100)
+
+    first, second = asyncio.run(fetch_twice())
+
+    assert first is second
+    assert swap_fetches == [(5000, 5049)]
+
+
+def test_swap_window_near_the_head_is_not_cached(swap_fetches):
+    # The last bucket ends a single block behind the head, well within SWAP_WINDOW_CONFIRMATIONS
+    last_bucket = LATEST_BLOCK // calculation.SWAP_WINDOW_BUCKET - 1
+
+    async def fetch_twice():
+        await calculation.get_swap_window(None, last_bucket, last_bucket)
+        await calculation.get_swap_window(None, last_bucket, last_bucket)
+
+    asyncio.run(fetch_twice())
+
+    assert swap_fetches == [(9950, 9999), (9950, 9999)]
+
+
+def test_swap_window_cache_evicts_least_recently_used(swap_fetches, monkeypatch):
+    monkeypatch.setattr(calculation, "SWAP_WINDOW_CACHE_SIZE", 2)
+
+    async def fetch_buckets(*buckets):
+        for bucket in buckets: await calculation.get_swap_window(None, bucket, bucket)
+
+    asyncio.run(fetch_buckets(1, 2, 1, 3))
+
+    assert list(calculation.swap_window_cache) == [(50, 99), (150, 199)]
+
+
+def test_concurrent_swap_window_calls_share_a_fetch(swap_fetches):
+    async def fetch_concurrently():
+        return await asyncio.gather(*[calculation.get_swap_window(None, 100, 100) for _ in range(3)])
+
+    windows = asyncio.run(fetch_concurrently())
+
+    assert swap_fetches == [(5000, 5049)]
+    assert windows[0] is windows[1] is windows[2]
+
+
+def test_cancelled_caller_does_not_cancel_shared_fetch(swap_fetches):
+    async def cancel_one_caller():
+        cancelled = asyncio.ensure_future(calculation.get_swap_window(None, 100, 100))
+        waiting = asyncio.ensure_future(calculation.get_swap_window(None, 100, 100))
+
+        await asyncio.sleep(0)
+        cancelled.cancel()
+
+        return await waiting
+
+    swaps = asyncio.run(cancel_one_caller())
+
+    assert [swap.block_number for swap in swaps] == [5000]
+    assert swap_fetches == [(5000, 5049)]
+    assert calculation.swap_window_inflight == {}
+
+
+def test_direct_swap_is_the_closest_to_the_block():
+    swaps = [
+        make_swap(990, TOKEN_A, TOKEN_B),
+        make_swap(1008, TOKEN_B, TOKEN_A),
+        make_swap(1010, TOKEN_A, TOKEN_C),
+        make_swap(1030, TOKEN_A, TOKEN_B),
+    ]
+
+    assert calculation.get_direct_swap(swaps, TOKEN_A, TOKEN_B, 1010) is swaps[1]
+    assert calculation.get_direct_swap(swaps, TOKEN_B, TOKEN_C, 1010) is None
+
+
+def test_direct_swap_ratio_is_exact_in_both_directions(swap_windows):
+    swaps_by_bucket, _ = swap_windows
+    swaps_by_bucket[20] = [make_swap(1010, TOKEN_A, TOKEN_B, 10 ** 18, 3000 * 10 ** 18)]
+
+    assert asyncio.run(calculation.find_swap_path(None, TOKEN_A, TOKEN_B, 1010)) == (3000.0, [TOKEN_A, TOKEN_B])
+    assert asyncio.run(calculation.find_swap_path(None, TOKEN_B, TOKEN_A, 1010)) == (1 / 3000, [TOKEN_B, TOKEN_A])
+
+
+def encode_int256(value: int) -> str:
+    return format(value % (1 << 256), "064x")
+
+
+@pytest.mark.parametrize("from_amount, to_amount", [
+    (10 ** 18, -3000 * 10 ** 6),
+    (-5, 7),
+    (-1, -(1 << 255)),
+    ((1 << 255) - 1, 0),
+])
+def test_decode_swap_amounts_returns_absolute_values(from_amount, to_amount):
+    data = "0x" + encode_int256(from_amount) + encode_int256(to_amount) + "0" * 64 * 3
+
+    assert calculation.decode_swap_amounts(data) == (abs(from_amount), abs(to_amount))